@@ -1,7 +1,9 @@
 import argparse
+import contextlib
 import logging
 import sys
 
+from src.elevation_model import ElevationModel
 from src.gpx_track_analyzer import TrackAnalyzer
 
 logging.basicConfig(format="%(asctime)s %(levelname)8s %(pathname)s: %(message)s", level=logging.INFO,
@@ -11,8 +13,11 @@ _LOGGER = logging.getLogger(__name__)
 
 def main():
     args = _parse_arguments()
-    analyzer = TrackAnalyzer(args.input_file)
-    analyzer.analyze()
+    with ElevationModel(args.elevation_tiles) if args.elevation_tiles else contextlib.nullcontext() as elevation_model:
+        analyzer = TrackAnalyzer(args.input_file, compress_output=args.compress,
+                                 processes=args.processes, pause_handling=args.pause_handling,
+                                 elevation_model=elevation_model)
+        analyzer.analyze()
     analyzer.get_maximal_values()
     _LOGGER.info(f"slope 100m {analyzer.slope_100}")
     _LOGGER.info(f"vertical_velocities 60s {analyzer.vertical_velocities_60s}")
@@ -25,6 +30,12 @@ def _parse_arguments():
     parser = argparse.ArgumentParser(description="Analyze given track.")
     parser.add_argument("--input_file", help="File to analyze", default="/home/prinzt/Downloads/2021-06-13_Um_den_Hohen_Göll.gpx")
     parser.add_argument("--output_file", help="File to analyze", default="/tmp/output.gpx")
+    parser.add_argument("--compress", help="Write gzip compressed output files", action="store_true")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="Number of processes analyzing chunks of the track (speedup at most about 1.5x)")
+    parser.add_argument("--pause_handling", default="keep", choices=TrackAnalyzer.PAUSE_HANDLINGS,
+                        help="Handling of pauses: keep or hold (best efforts only) or remove (cut from the time axis)")
+    parser.add_argument("--elevation_tiles", help="Directory with SRTM .hgt tiles to correct the elevations")
 
     return parser.parse_args()
 
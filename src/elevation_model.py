@@ -0,0 +1,104 @@
+import collections
+import logging
+import math
+import mmap
+import os
+import struct
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class ElevationModel(object):
+    """
+    Digital elevation model read from SRTM .hgt tiles (e.g. N47E011.hgt) in a local directory. Tiles are memory
+    mapped and kept in a least recently used cache, so one model can be shared by all tracks of an archive.
+    """
+    VOID = -32768
+
+    def __init__(self, directory, max_open_tiles=16):
+        self.directory = directory
+        self.max_open_tiles = max_open_tiles
+        self.tiles = collections.OrderedDict()
+
+    def get_elevations(self, latitudes, longitudes):
+        """
+        Returns the bilinear interpolated elevation for each position, or None if there is no tile or no data for
+        it. The positions are grouped by tile, so each tile is looked up once per call.
+        """
+        elevations = [None] * len(latitudes)
+        indices_by_tile = collections.defaultdict(list)
+        for i, (latitude, longitude) in enumerate(zip(latitudes, longitudes)):
+            indices_by_tile[(math.floor(latitude), math.floor(longitude))].append(i)
+        for (latitude, longitude), indices in indices_by_tile.items():
+            tile = self.get_tile(latitude, longitude)
+            if tile:
+                for i in indices:
+                    elevations[i] = tile.get_elevation(latitudes[i], longitudes[i])
+        return elevations
+
+    def get_tile(self, latitude, longitude):
+        name = get_tile_name(latitude, longitude)
+        if name in self.tiles:
+            self.tiles.move_to_end(name)
+            return self.tiles[name]
+        file = os.path.join(self.directory, name)
+        tile = HgtTile(file, latitude, longitude) if os.path.exists(file) else None
+        if tile is None:
+            _LOGGER.info(f"No elevation tile {file}")
+        self.tiles[name] = tile
+        if len(self.tiles) > self.max_open_tiles:
+            _, removed_tile = self.tiles.popitem(last=False)
+            if removed_tile:
+                removed_tile.close()
+        return tile
+
+    def close(self):
+        for tile in self.tiles.values():
+            if tile:
+                tile.close()
+        self.tiles.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class HgtTile(object):
+    """One memory mapped tile of big endian 16 bit elevations, rows from north to south."""
+
+    def __init__(self, file, latitude, longitude):
+        self.latitude = latitude
+        self.longitude = longitude
+        with open(file, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = math.isqrt(len(self.data) // 2)
+        if self.size * self.size * 2 != len(self.data):
+            self.data.close()
+            raise ValueError(f"Elevation tile {file} is not square")
+
+    def get_elevation(self, latitude, longitude):
+        row = (self.latitude + 1 - latitude) * (self.size - 1)
+        column = (longitude - self.longitude) * (self.size - 1)
+        top = min(int(row), self.size - 2)
+        left = min(int(column), self.size - 2)
+        values = [self.get_value(top, left), self.get_value(top, left + 1),
+                  self.get_value(top + 1, left), self.get_value(top + 1, left + 1)]
+        if ElevationModel.VOID in values:
+            return None
+        row_fraction = row - top
+        column_fraction = column - left
+        upper = values[0] + (values[1] - values[0]) * column_fraction
+        lower = values[2] + (values[3] - values[2]) * column_fraction
+        return upper + (lower - upper) * row_fraction
+
+    def get_value(self, row, column):
+        return struct.unpack_from(">h", self.data, (row * self.size + column) * 2)[0]
+
+    def close(self):
+        self.data.close()
+
+
+def get_tile_name(latitude, longitude):
+    return f"{'N' if latitude >= 0 else 'S'}{abs(latitude):02d}{'E' if longitude >= 0 else 'W'}{abs(longitude):03d}.hgt"
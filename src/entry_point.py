@@ -7,9 +7,11 @@ from garminconnect import (
     GarminConnectTooManyRequestsError,
     GarminConnectAuthenticationError,
 )
+from elevation_model import ElevationModel
 from gpx_track_analyzer import TrackAnalyzer
 
 BASE_URL = 'https://connect.garmin.com'
+_elevation_model = None
 
 
 def get_authenticated_client(user_name, password):
@@ -220,9 +222,20 @@ def update_power_data(activity, api, date):
         activity['maxAvgPower_18000'] = power_data['entries'][14]['power']
 
 
-def analyze_gpx_track(path):
+def get_elevation_model(elevation_tiles):
+    """Returns the elevation model of the given tile directory, shared by all tracks analyzed in this process."""
+    global _elevation_model
+    if _elevation_model is None or _elevation_model.directory != elevation_tiles:
+        if _elevation_model:
+            _elevation_model.close()
+        _elevation_model = ElevationModel(elevation_tiles)
+    return _elevation_model
+
+
+def analyze_gpx_track(path, elevation_tiles=None):
     try:
-        analyzer = TrackAnalyzer(path)
+        elevation_model = get_elevation_model(elevation_tiles) if elevation_tiles else None
+        analyzer = TrackAnalyzer(path, elevation_model=elevation_model)
         analyzer.analyze()
         analyzer.get_maximal_values()
         analyzer.write_file()
@@ -1,10 +1,21 @@
+import bisect
+import contextlib
 import datetime
+import array as mod_array
+import gzip
 import json
 import logging
 import math
+import os
+import shutil
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
 import geopy.distance
+import gpxpy.geo as mod_geo
 import gpxpy.gpx
+import gpxpy.gpxfield as mod_gpxfield
 import lxml.etree as mod_etree
 
 logging.basicConfig(format="%(asctime)s %(levelname)8s %(pathname)s: %(message)s", level=logging.INFO,
@@ -17,12 +28,35 @@ class TrackAnalyzer(object):
     NAMESPACE = '{' + NAMESPACE_NAME + '}'
     TRACK_EXTENSIONS = 'TrackPointExtension'
     SUFFIX = "_simplified"
+    COMPRESSED_SUFFIX = ".gz"
+    CHUNKS_PER_PROCESS = 4
+    MAX_BATCH_SIZE_PER_PROCESS = 16
+    EXTENSION_FIELDS = {"hr": "heart_rate", "cad": "cadence", "atemp": "temperature", "power": "power",
+                        "PowerInWatts": "power"}
+    BEST_EFFORT_FIELDS = ["heart_rate", "cadence", "power"]
+    BEST_EFFORT_DURATIONS = [1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 18000]
+    MAX_RESAMPLING_GAP = 30
+    PAUSE_HANDLINGS = ["keep", "hold", "remove"]
+    MAX_INTERPOLATED_ELEVATIONS = 100
 
-    def __init__(self, file, update_track_with_calculated_values=False):
+    def __init__(self, file, update_track_with_calculated_values=False, compress_output=False, processes=1,
+                 pause_handling="keep", elevation_model=None):
+        """
+        pause_handling defines how gaps longer than MAX_RESAMPLING_GAP seconds between points with time are treated:
+        "keep" leaves them empty, "hold" fills them with the value before the gap and "remove" cuts them out of the
+        time axis. The vertical velocities are computed on the recorded points, so only "remove" changes them; "hold"
+        only affects the resampled values of the best efforts.
+        If an elevation_model is given, the slopes and vertical velocities are computed from its elevations.
+        """
+        if pause_handling not in self.PAUSE_HANDLINGS:
+            raise ValueError(f"Unknown pause handling {pause_handling}, expected one of {self.PAUSE_HANDLINGS}")
         self.file = file
         self.data = {}
         self.all_points = []
         self.points_with_time = []
+        self.times = []
+        self.max_times = []
+        self.corrected_elevations = []
         self.gpx = None
         self.slopes = []
         self.vertical_velocities = {}
@@ -30,33 +64,75 @@ class TrackAnalyzer(object):
         self.vertical_velocities_60s = 0
         self.vertical_velocities_600s = 0
         self.vertical_velocities_3600s = 0
+        self.extension_values = {}
+        self.best_efforts = {}
         self.duration = 0
         self.update_track_with_calculated_values = update_track_with_calculated_values
+        self.compress_output = compress_output
+        self.processes = processes
+        self.pause_handling = pause_handling
+        self.elevation_model = elevation_model
 
     def write_file(self, file=None):
+        """
+        Writes the annotated track (if requested), the summary json and the simplified track. All outputs are
+        streamed from self.gpx into temporary files which are renamed atomically; self.gpx is left unchanged.
+        """
         if not file:
             file = self.file
+        suffix = self.COMPRESSED_SUFFIX if self.compress_output else ""
         if self.update_track_with_calculated_values:
-            with open(file, "w") as f:
-                f.write(self.gpx.to_xml())
+            write_atomically(file + suffix, iter_gpx_xml(self.gpx), self.compress_output)
         gpx_file_simplified = prefix_filename(file)
         gpx_file_gpxpy = file.replace(".gpx", "_gpxpy.json")
-        self.set_gpx_data()
-        with open(gpx_file_gpxpy, 'w') as fp:
-            json.dump(self.data, fp, indent=4)
-        self.gpx.simplify()
-        with open(gpx_file_simplified, 'w') as f:
-            f.write(self.gpx.to_xml())
+        extremes = self.gpx.get_elevation_extremes()
+        with self.smoothed_elevations():
+            self.update_gpx_data(extremes)
+            write_atomically(gpx_file_gpxpy + suffix, json.JSONEncoder(indent=4).iterencode(self.data),
+                             self.compress_output)
+            with self.simplified_segments():
+                write_atomically(gpx_file_simplified + suffix, iter_gpx_xml(self.gpx), self.compress_output)
+
+    @contextlib.contextmanager
+    def smoothed_elevations(self):
+        """Smooths the elevations of self.gpx for the duration of the context and restores them afterwards."""
+        saved_segments = [(segment, segment.points, [point.elevation for point in segment.points])
+                          for track in self.gpx.tracks for segment in track.segments]
+        self.gpx.smooth()
+        try:
+            yield
+        finally:
+            for segment, points, elevations in saved_segments:
+                segment.points = points
+                for point, elevation in zip(points, elevations):
+                    point.elevation = elevation
+
+    @contextlib.contextmanager
+    def simplified_segments(self):
+        """Replaces the points of all segments by their simplified subset for the duration of the context."""
+        saved_segments = [(segment, segment.points) for track in self.gpx.tracks for segment in track.segments]
+        for segment, points in saved_segments:
+            segment.points = mod_geo.simplify_polyline(points, None)
+        try:
+            yield
+        finally:
+            for segment, points in saved_segments:
+                segment.points = points
 
     def analyze(self):
         start_time = datetime.datetime.now()
-        self.set_all_points_with_distance()
-        current_date_time = datetime.datetime.now()
-        self.set_vertical_velocity(60, True)
-        self.set_vertical_velocity(600)
-        self.set_vertical_velocity(3600)
-        print(f"Time {(datetime.datetime.now() - current_date_time).total_seconds()}")
-        self.set_slope(100)
+        if self.processes > 1:
+            self.analyze_in_chunks([60, 600, 3600], 100)
+        else:
+            self.set_all_points_with_distance()
+            current_date_time = datetime.datetime.now()
+            self.set_vertical_velocity(60, True)
+            self.set_vertical_velocity(600)
+            self.set_vertical_velocity(3600)
+            print(f"Time {(datetime.datetime.now() - current_date_time).total_seconds()}")
+            self.set_slope(100)
+        self.set_extension_values()
+        self.set_best_efforts()
         self.duration = (datetime.datetime.now() - start_time).total_seconds()
         _LOGGER.info(f"Took {self.duration}")
 
@@ -71,26 +147,176 @@ class TrackAnalyzer(object):
 
     def set_all_points_with_distance(self):
         _LOGGER.info(f"Read and add distance to track file {self.file}")
-        gpx_file = open(self.file, 'r')
-        self.gpx = gpxpy.parse(gpx_file)
+        self.read_points()
         distance = 0.0
         for track in self.gpx.tracks:
             for segment in track.segments:
                 last_point = None
-                points = []
                 for point in segment.points:
-                    if point.latitude != 0 and point.longitude != 0:
-                        if last_point:
-                            distance += geopy.distance.distance((last_point.latitude, last_point.longitude),
-                                                                (point.latitude, point.longitude)).km
-                        self.set_tag_in_extensions(distance * 1000, point, "distance")
-                        point.distance = distance * 1000
-                        last_point = point
-                        self.all_points.append(point)
-                        if point.time:
-                            self.points_with_time.append(point)
-                        points.append(point)
-                segment.points = points
+                    if last_point:
+                        distance += geopy.distance.distance((last_point.latitude, last_point.longitude),
+                                                            (point.latitude, point.longitude)).km
+                    self.set_tag_in_extensions(distance * 1000, point, "distance")
+                    point.distance = distance * 1000
+                    last_point = point
+        self.set_times()
+        self.set_corrected_elevations()
+
+    def read_points(self):
+        """Parses the track and removes the points without coordinates."""
+        with open(self.file, 'r') as gpx_file:
+            self.gpx = gpxpy.parse(gpx_file)
+        for track in self.gpx.tracks:
+            for segment in track.segments:
+                segment.points = [point for point in segment.points if point.latitude != 0 and point.longitude != 0]
+                self.all_points.extend(segment.points)
+        self.points_with_time = [point for point in self.all_points if point.time]
+
+    def set_corrected_elevations(self):
+        """
+        Sets the elevations the slopes and vertical velocities are computed from: the elevations of the elevation
+        model, with voids of at most MAX_INTERPOLATED_ELEVATIONS points interpolated along the track. If the model
+        can't cover the whole track that way, the recorded ones are kept for all points, as a track mixing both would
+        jump between them. The points of the track keep the recorded ones.
+        """
+        self.corrected_elevations = [point.elevation for point in self.all_points]
+        if not self.elevation_model or not self.all_points:
+            return
+        elevations = self.elevation_model.get_elevations([point.latitude for point in self.all_points],
+                                                         [point.longitude for point in self.all_points])
+        interpolated_elevations = interpolate_missing_values(elevations, self.MAX_INTERPOLATED_ELEVATIONS)
+        if interpolated_elevations is None:
+            _LOGGER.info(f"Elevation model has no data for parts of track {self.file}, keep the recorded elevations")
+            return
+        self.corrected_elevations = interpolated_elevations
+        interpolated = len([elevation for elevation in elevations if elevation is None])
+        _LOGGER.info(f"Corrected {len(elevations)} elevations, {interpolated} of them interpolated")
+
+    def get_corrected_elevations_with_time(self):
+        return [elevation for point, elevation in zip(self.all_points, self.corrected_elevations) if point.time]
+
+    def set_times(self):
+        """
+        Converts the times of the points with time to seconds since the first one and sets their running maxima, so
+        time windows are looked up by bisection without datetime arithmetic.
+        """
+        epoch_times = [get_epoch_seconds(point.time) for point in self.points_with_time]
+        self.times = []
+        for i, epoch_time in enumerate(epoch_times):
+            if i == 0:
+                self.times.append(0.0)
+            else:
+                diff_times = epoch_time - epoch_times[i - 1]
+                if self.pause_handling == "remove" and diff_times > self.MAX_RESAMPLING_GAP:
+                    diff_times = 1.0
+                self.times.append(self.times[-1] + diff_times)
+        self.max_times = get_running_maxima(self.times)
+
+    def analyze_in_chunks(self, max_time_intervals, max_meter_interval):
+        """
+        Analyzes the track with a pool of self.processes processes, giving exactly the results of the serial methods.
+        The distances are computed in chunks of the point arrays, each chunk reading the point before it from shared
+        memory. The windows of the vertical velocity scans are evaluated in parallel batches, see
+        get_vertical_velocities_in_parallel. The (cheap) slope scan runs in one process next to them.
+        """
+        _LOGGER.info(f"Read and analyze track file {self.file} with {self.processes} processes")
+        self.read_points()
+        self.set_times()
+        self.set_corrected_elevations()
+        n = len(self.all_points)
+        new_segment = []
+        for track in self.gpx.tracks:
+            for segment in track.segments:
+                new_segment.extend(float(i == 0) for i in range(len(segment.points)))
+        with SharedArrays() as arrays:
+            arrays.create("latitude", [point.latitude for point in self.all_points])
+            arrays.create("longitude", [point.longitude for point in self.all_points])
+            arrays.create("new_segment", new_segment)
+            arrays.create("distance", [0.0] * n)
+            arrays.create("elevation", [math.nan if elevation is None else elevation
+                                        for elevation in self.corrected_elevations])
+            arrays.create("time", self.times)
+            arrays.create("max_time", self.max_times)
+            arrays.create("time_elevation", self.get_corrected_elevations_with_time())
+            with ProcessPoolExecutor(self.processes, initializer=attach_shared_arrays,
+                                     initargs=(arrays.specs,)) as executor:
+                chunk_size = max(1, math.ceil(n / (self.processes * self.CHUNKS_PER_PROCESS)))
+                for future in [executor.submit(set_distances_in_chunk, start, chunk_size)
+                               for start in range(0, n, chunk_size)]:
+                    future.result()
+                distances = arrays.arrays["distance"]
+                distance = 0.0
+                for i, point in enumerate(self.all_points):
+                    distance += distances[i]
+                    self.set_tag_in_extensions(distance * 1000, point, "distance")
+                    point.distance = distance * 1000
+                    distances[i] = point.distance
+                slopes = executor.submit(get_slopes_of_shared_arrays, max_meter_interval)
+                for max_time_interval in max_time_intervals:
+                    steps = self.get_vertical_velocities_in_parallel(executor, max_time_interval)
+                    self.set_vertical_velocities(max_time_interval, steps, max_time_interval == max_time_intervals[0])
+                self.set_slopes(*slopes.result())
+
+    def get_vertical_velocities_in_parallel(self, executor, max_time_interval):
+        """
+        Replays the scan of get_vertical_velocities, evaluating its windows in parallel. Until a new maximum is
+        found the scan moves on by 25 points, so the windows starting at the next strided points are evaluated in a
+        batch by all processes, each window reading its max_time_interval seconds ahead from shared memory. The scan
+        then decides with exactly the serial values; a new maximum discards the rest of the batch. The batch size
+        doubles after each batch without a new maximum and restarts at self.processes after one. Every new maximum
+        costs a round trip to the pool, so climbs with many of them bound the speedup, to about 1.5x with 4 to 8
+        processes for a 24 h track.
+        """
+        steps = []
+        vertical_velocities = {}
+        batch_size = self.processes
+        vertical_velocity = 0
+        i = 0
+        while i < len(self.points_with_time):
+            if i not in vertical_velocities:
+                starts = list(range(i, min(i + 25 * batch_size, len(self.points_with_time)), 25))
+                tasks = [starts[k::self.processes] for k in range(self.processes) if starts[k::self.processes]]
+                for task, future in zip(tasks, [executor.submit(get_vertical_velocities_at, task, max_time_interval)
+                                                for task in tasks]):
+                    vertical_velocities.update(zip(task, future.result()))
+                batch_size = min(2 * batch_size, self.processes * self.MAX_BATCH_SIZE_PER_PROCESS)
+            current_velocity = vertical_velocities[i]
+            if current_velocity is None:
+                break
+            if current_velocity > vertical_velocity:
+                vertical_velocity = current_velocity
+                i += 1
+                batch_size = self.processes
+            else:
+                i += 25
+            steps.append((i, vertical_velocity))
+        return steps
+
+    def set_extension_values(self):
+        """Reads heart rate, cadence, temperature and power of the points with time into one list per field."""
+        self.extension_values = {}
+        for i, point in enumerate(self.points_with_time):
+            for element in [e for extension in point.extensions for e in extension.iter()]:
+                name = self.EXTENSION_FIELDS.get(element.tag.rsplit("}", 1)[-1])
+                if name and element.text:
+                    try:
+                        value = float(element.text)
+                    except ValueError:
+                        _LOGGER.debug(f"Skip {name} {element.text!r} of point {i}")
+                        continue
+                    if name not in self.extension_values:
+                        self.extension_values[name] = [None] * len(self.points_with_time)
+                    self.extension_values[name][i] = value
+
+    def set_best_efforts(self):
+        """Sets the maximal average of heart rate, cadence and power over each of BEST_EFFORT_DURATIONS seconds."""
+        self.best_efforts = {}
+        for name in [name for name in self.BEST_EFFORT_FIELDS if name in self.extension_values]:
+            self.best_efforts[name] = {}
+            for values in resample_to_seconds(self.times, self.extension_values[name], self.MAX_RESAMPLING_GAP,
+                                              self.pause_handling == "hold", max(self.BEST_EFFORT_DURATIONS)):
+                for duration, average in get_best_averages(values, self.BEST_EFFORT_DURATIONS).items():
+                    self.best_efforts[name][duration] = max(average, self.best_efforts[name].get(duration, average))
 
     def set_tag_in_extensions(self, value, point, tag_name):
         tag = f"{self.NAMESPACE}{self.TRACK_EXTENSIONS}"
@@ -105,71 +331,34 @@ class TrackAnalyzer(object):
             elements.append(root)
 
     def set_slope(self, max_meter_interval, use_regression=True):
-        sum_meters = 0.0
-        i = 0
-        track_points_for_interval = []
-        middle_entry = None
-        while i < len(self.all_points) - 1:
-            if middle_entry and sum_meters >= max_meter_interval and len(track_points_for_interval) > 2:
-                if use_regression:
-                    x_array = [entry.distance for entry in track_points_for_interval]
-                    y_array = [entry.elevation for entry in track_points_for_interval]
-                    if len(set(y_array)) > 1:
-                        linear_regression = estimate_coefficients(x_array, y_array)
-                        slope = linear_regression[1] * 100 if linear_regression[2] > 0.9 else 0.0
-                    else:
-                        slope = 0
-                else:
-                    elevation = track_points_for_interval[-1].elevation - track_points_for_interval[0].elevation
-                    slope = 0.0 if sum_meters == 0.0 else (elevation / sum_meters) * 100
-                self.slopes.append(slope)
-                track_points_for_interval = track_points_for_interval[1: -1]
-                middle_entry = track_points_for_interval[0]
-            else:
-                slope = 0
-            self.set_tag_in_extensions(slope * 100, self.all_points[i], "slope")
-            if not self.all_points[i].distance is None and self.all_points[i].distance >= 0.0 and self.all_points[
-                i].elevation:
-                track_points_for_interval.append(self.all_points[i])
-                sum_meters = track_points_for_interval[-1].distance - track_points_for_interval[0].distance
-                if sum_meters > max_meter_interval / 2 and not middle_entry:
-                    middle_entry = self.all_points[i]
-            i += 1
+        self.set_slopes(*get_slopes([point.distance for point in self.all_points],
+                                    self.corrected_elevations, max_meter_interval, use_regression))
+
+    def set_slopes(self, slopes, point_slopes):
+        self.slopes.extend(slopes)
+        for point, slope in zip(self.all_points, point_slopes):
+            self.set_tag_in_extensions(slope * 100, point, "slope")
 
     def set_vertical_velocity(self, max_time_interval, update_points=False):
-        self.vertical_velocities[str(max_time_interval)] = []
-        if len(self.points_with_time) > 0:
-            vertical_velocity = 0
-            i = 0
-            while i < len(self.points_with_time):
-                j = i + 10
-                if j >= len(self.points_with_time) - 1:
-                    break
-                diff_times = 0.0
-                while diff_times < max_time_interval:
-                    if j >= len(self.points_with_time) - 1:
-                        break
-                    diff_times = (self.points_with_time[j].time - self.points_with_time[i].time).total_seconds()
-                    j += 1
-                track_points_for_interval = self.points_with_time[i:j]
-                reduced_track_points_for_interval = reduce_track_to_relevant_elevation_points(track_points_for_interval)
-                relevant_track_points_for_interval, gain, loss = remove_elevation_differences_smaller_as(
-                    reduced_track_points_for_interval, 10)
-                current_velocity = 0.0 if diff_times == 0.0 else (gain / diff_times)
-                if current_velocity > vertical_velocity:
-                    vertical_velocity = current_velocity
-                    i += 1
-                else:
-                    i += 25
-                if update_points and i < len(self.all_points):
+        steps = get_vertical_velocities(self.times, self.max_times, self.get_corrected_elevations_with_time(),
+                                        max_time_interval)
+        self.set_vertical_velocities(max_time_interval, steps, update_points)
+
+    def set_vertical_velocities(self, max_time_interval, steps, update_points):
+        self.vertical_velocities[str(max_time_interval)] = [vertical_velocity for _, vertical_velocity in steps]
+        if update_points:
+            for i, vertical_velocity in steps:
+                if i < len(self.all_points):
                     self.set_tag_in_extensions(vertical_velocity * max_time_interval, self.all_points[i],
                                                "vvelocity")
 
-                self.vertical_velocities[str(max_time_interval)].append(vertical_velocity)
-
     def set_gpx_data(self):
         extremes = self.gpx.get_elevation_extremes()
-        self.gpx.smooth()
+        with self.smoothed_elevations():
+            self.update_gpx_data(extremes)
+
+    def update_gpx_data(self, extremes):
+        """Sets self.data from self.gpx, which is expected to be smoothed, and the unsmoothed extremes."""
         moving_data = self.gpx.get_moving_data()
         uphill_downhill = self.gpx.get_uphill_downhill()
         self.data = {
@@ -187,65 +376,78 @@ class TrackAnalyzer(object):
             "vertical_velocities_600s": round(self.vertical_velocities_600s, 3),
             "vertical_velocities_3600s": round(self.vertical_velocities_3600s, 3)
         }
+        for name, best_efforts in self.best_efforts.items():
+            for duration, best_effort in best_efforts.items():
+                self.data[f"max_avg_{name}_{duration}s"] = round(best_effort, 1)
 
 
 def reduce_track_to_relevant_elevation_points(points):
-    reduced_points = []
-    points_with_doubles = []
+    return [points[i] for i in get_relevant_elevation_indices([point.elevation for point in points])]
+
+
+def get_relevant_elevation_indices(elevations):
+    indices_with_doubles = []
     i = 0
-    for point in points:
-        current_elevation = round(point.elevation)
-        if i == 0 or i == len(points) - 1:
-            points_with_doubles.append(point)
+    for elevation in elevations:
+        current_elevation = round(elevation)
+        if i == 0 or i == len(elevations) - 1:
+            indices_with_doubles.append(i)
         else:
-            last_elevation = round(points[i - 1].elevation) if (i != 0) else current_elevation
+            last_elevation = round(elevations[i - 1]) if (i != 0) else current_elevation
             if current_elevation != last_elevation:
-                points_with_doubles.append(point)
+                indices_with_doubles.append(i)
         i += 1
+    reduced_indices = []
     j = 0
-    for point in points_with_doubles:
-        current_elevation = round(point.elevation)
-        last_elevation = round(points_with_doubles[j - 1].elevation) if (j != 0) else current_elevation
-        next_elevation = round(points_with_doubles[j + 1].elevation) if (
-                j != len(points_with_doubles) - 1) else current_elevation
-        if j == 0 or j == len(points_with_doubles) - 1:
-            reduced_points.append(point)
+    for index in indices_with_doubles:
+        current_elevation = round(elevations[index])
+        last_elevation = round(elevations[indices_with_doubles[j - 1]]) if (j != 0) else current_elevation
+        next_elevation = round(elevations[indices_with_doubles[j + 1]]) if (
+                j != len(indices_with_doubles) - 1) else current_elevation
+        if j == 0 or j == len(indices_with_doubles) - 1:
+            reduced_indices.append(index)
         elif current_elevation != last_elevation and current_elevation != next_elevation:
             if math.copysign(1, current_elevation - last_elevation) != math.copysign(1,
                                                                                      next_elevation - current_elevation):
-                reduced_points.append(point)
+                reduced_indices.append(index)
         j += 1
-    return reduced_points
+    return reduced_indices
 
 
 def remove_elevation_differences_smaller_as(points, minimal_delta):
-    filtered_points = []
+    indices, elevation_gain, elevation_loss = get_indices_without_elevation_differences_smaller_as(
+        [point.elevation for point in points], minimal_delta)
+    return [points[i] for i in indices], elevation_gain, elevation_loss
+
+
+def get_indices_without_elevation_differences_smaller_as(elevations, minimal_delta):
+    filtered_indices = []
     elevation_gain = 0.0
     elevation_loss = 0.0
     i = 0
-    for point in points:
+    for elevation in elevations:
         if i == 0:
-            filtered_points.append(point)
+            filtered_indices.append(i)
         else:
-            delta = point.elevation - filtered_points[-1].elevation
-            delta_to_second_last = point.elevation - filtered_points[-2].elevation if len(filtered_points) > 1 else 0
-            delta_from_last = filtered_points[-1].elevation - filtered_points[-2].elevation if len(
-                filtered_points) > 1 else 0
+            delta = elevation - elevations[filtered_indices[-1]]
+            delta_to_second_last = elevation - elevations[filtered_indices[-2]] if len(filtered_indices) > 1 else 0
+            delta_from_last = elevations[filtered_indices[-1]] - elevations[filtered_indices[-2]] if len(
+                filtered_indices) > 1 else 0
             if abs(delta) >= minimal_delta:
-                filtered_points.append(point)
+                filtered_indices.append(i)
                 if delta > 0:
                     elevation_gain += delta
                 else:
                     elevation_loss += delta
             elif abs(delta_to_second_last) > abs(delta_from_last):
-                filtered_points.pop(-1)
-                filtered_points.append(point)
+                filtered_indices.pop(-1)
+                filtered_indices.append(i)
                 if delta > 0:
                     elevation_gain += delta
                 else:
                     elevation_loss += delta
         i += 1
-    return filtered_points, elevation_gain, elevation_loss
+    return filtered_indices, elevation_gain, elevation_loss
 
 
 def estimate_coefficients(x_array, y_array):
@@ -269,5 +471,329 @@ def estimate_coefficients(x_array, y_array):
     return b_0, b_1, r
 
 
+class SharedArrays(object):
+    """Float arrays in shared memory, which can be attached by name in other processes."""
+
+    def __init__(self):
+        self.memories = []
+        self.arrays = {}
+        self.specs = {}
+
+    def create(self, name, values):
+        memory = shared_memory.SharedMemory(create=True, size=max(1, len(values)) * 8)
+        self.memories.append(memory)
+        array = memory.buf[:len(values) * 8].cast("d")
+        array[:] = mod_array.array("d", values)
+        self.arrays[name] = array
+        self.specs[name] = (memory.name, len(values))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for array in self.arrays.values():
+            array.release()
+        self.arrays = {}
+        for memory in self.memories:
+            memory.close()
+            memory.unlink()
+        self.memories = []
+
+
+_WORKER_MEMORIES = []
+_WORKER_ARRAYS = {}
+
+
+def attach_shared_arrays(specs):
+    for name, (memory_name, length) in specs.items():
+        memory = shared_memory.SharedMemory(name=memory_name)
+        _WORKER_MEMORIES.append(memory)
+        _WORKER_ARRAYS[name] = memory.buf[:length * 8].cast("d")
+
+
+def set_distances_in_chunk(start, chunk_size):
+    """Sets the distance in km of each point of the chunk to its predecessor in the same segment."""
+    latitudes = _WORKER_ARRAYS["latitude"]
+    longitudes = _WORKER_ARRAYS["longitude"]
+    new_segment = _WORKER_ARRAYS["new_segment"]
+    distances = _WORKER_ARRAYS["distance"]
+    for i in range(start, min(start + chunk_size, len(distances))):
+        if new_segment[i]:
+            distances[i] = 0.0
+        else:
+            distances[i] = geopy.distance.distance((latitudes[i - 1], longitudes[i - 1]),
+                                                   (latitudes[i], longitudes[i])).km
+
+
+def get_slopes_of_shared_arrays(max_meter_interval):
+    return get_slopes(_WORKER_ARRAYS["distance"], _WORKER_ARRAYS["elevation"], max_meter_interval)
+
+
+def get_vertical_velocities_at(starts, max_time_interval):
+    return [get_vertical_velocity(_WORKER_ARRAYS["time"], _WORKER_ARRAYS["max_time"],
+                                  _WORKER_ARRAYS["time_elevation"], i, max_time_interval) for i in starts]
+
+
+def get_slopes(distances, elevations, max_meter_interval, use_regression=True):
+    """
+    Returns the slopes of the intervals of at least max_meter_interval meters and the slope at each point but the
+    last one (0 where no interval was completed).
+    """
+    slopes = []
+    point_slopes = []
+    sum_meters = 0.0
+    i = 0
+    indices_for_interval = []
+    middle_entry = None
+    while i < len(distances) - 1:
+        if middle_entry is not None and sum_meters >= max_meter_interval and len(indices_for_interval) > 2:
+            if use_regression:
+                x_array = [distances[k] for k in indices_for_interval]
+                y_array = [elevations[k] for k in indices_for_interval]
+                if len(set(y_array)) > 1:
+                    linear_regression = estimate_coefficients(x_array, y_array)
+                    slope = linear_regression[1] * 100 if linear_regression[2] > 0.9 else 0.0
+                else:
+                    slope = 0
+            else:
+                elevation = elevations[indices_for_interval[-1]] - elevations[indices_for_interval[0]]
+                slope = 0.0 if sum_meters == 0.0 else (elevation / sum_meters) * 100
+            slopes.append(slope)
+            indices_for_interval = indices_for_interval[1: -1]
+            middle_entry = indices_for_interval[0]
+        else:
+            slope = 0
+        point_slopes.append(slope)
+        if distances[i] is not None and distances[i] >= 0.0 and elevations[i] and not math.isnan(elevations[i]):
+            indices_for_interval.append(i)
+            sum_meters = distances[indices_for_interval[-1]] - distances[indices_for_interval[0]]
+            if sum_meters > max_meter_interval / 2 and middle_entry is None:
+                middle_entry = i
+        i += 1
+    return slopes, point_slopes
+
+
+def get_vertical_velocities(times, max_times, elevations, max_time_interval):
+    """
+    Scans the windows of max_time_interval seconds, moving on by one point after a new maximal vertical velocity and
+    by 25 points otherwise. Returns the index reached and the maximal vertical velocity so far after each step.
+    """
+    steps = []
+    vertical_velocity = 0
+    i = 0
+    while i < len(times):
+        current_velocity = get_vertical_velocity(times, max_times, elevations, i, max_time_interval)
+        if current_velocity is None:
+            break
+        if current_velocity > vertical_velocity:
+            vertical_velocity = current_velocity
+            i += 1
+        else:
+            i += 25
+        steps.append((i, vertical_velocity))
+    return steps
+
+
+def get_vertical_velocity(times, max_times, elevations, i, max_time_interval):
+    """
+    Returns the elevation gain per second of the window starting at point i, which reaches at least
+    max_time_interval seconds and 10 points ahead, or None if there are not enough points after i.
+    """
+    j = get_window_end(times, max_times, i, max_time_interval)
+    if j is None:
+        return None
+    diff_times = times[j] - times[i]
+    elevations_for_interval = list(elevations[i:j + 1])
+    reduced_elevations = [elevations_for_interval[k] for k in
+                          get_relevant_elevation_indices(elevations_for_interval)]
+    _, gain, _ = get_indices_without_elevation_differences_smaller_as(reduced_elevations, 10)
+    return 0.0 if diff_times == 0.0 else (gain / diff_times)
+
+
+def get_window_end(times, max_times, i, max_time_interval):
+    """
+    Returns the index of the first point at least max_time_interval seconds and 10 points after point i (at most
+    the second last point), or None if there are not enough points after i.
+    """
+    if i + 10 >= len(times) - 1:
+        return None
+    end_time = times[i] + max_time_interval
+    j = bisect.bisect_left(max_times, end_time)
+    if j < i + 10:
+        j = i + 10
+    while j < len(times) and times[j] < end_time:
+        j += 1
+    return min(j, len(times) - 2)
+
+
+def get_running_maxima(times):
+    """
+    Returns the latest time up to each point. It is sorted also if the times are not monotonic, so the first point
+    at or after a time is found by bisection, with one entry per point however long the track is.
+    """
+    max_times = []
+    for time in times:
+        max_times.append(max(time, max_times[-1]) if max_times else time)
+    return max_times
+
+
+def interpolate_missing_values(values, max_missing):
+    """
+    Returns the values with each run of None replaced linearly between the values around it, or None if a run is at
+    the start or the end or longer than max_missing values.
+    """
+    interpolated_values = list(values)
+    last = None
+    for i, value in enumerate(values):
+        if value is None:
+            continue
+        if last is None and i > 0 or last is not None and i - last - 1 > max_missing:
+            return None
+        if last is not None:
+            for k in range(last + 1, i):
+                interpolated_values[k] = values[last] + (value - values[last]) * (k - last) / (i - last)
+        last = i
+    return interpolated_values if last == len(values) - 1 else None
+
+
+def get_epoch_seconds(time):
+    if time.tzinfo is None:
+        time = time.replace(tzinfo=datetime.timezone.utc)
+    return time.timestamp()
+
+
+def resample_to_seconds(times, values, max_gap, hold_gaps=False, max_held_gap=None):
+    """
+    Returns one value per second since the earliest time, holding each value until the next point, as segments of
+    consecutive seconds with a value. A gap longer than max_gap seconds ends the segment, unless hold_gaps is set, in
+    which case at most max_held_gap seconds of it are held. So the number of seconds is bounded by the number of
+    points, however long the pauses between them are. A point with a time before its predecessor only sets its own
+    second.
+    """
+    start_time = min(times)
+    intervals = []
+    for i in range(len(times)):
+        if values[i] is None:
+            continue
+        second = int(times[i] - start_time)
+        next_second = int(times[i + 1] - start_time) if i + 1 < len(times) else second
+        if next_second - second > max_gap:
+            next_second = second if not hold_gaps else second + min(next_second - second, max_held_gap or math.inf)
+        intervals.append((second, max(second + 1, next_second), values[i]))
+    segment_starts = []
+    segment_ends = []
+    for second, next_second, _ in sorted(intervals):
+        if segment_ends and second <= segment_ends[-1]:
+            segment_ends[-1] = max(segment_ends[-1], next_second)
+        else:
+            segment_starts.append(second)
+            segment_ends.append(next_second)
+    segments = [[None] * (end - start) for start, end in zip(segment_starts, segment_ends)]
+    for second, next_second, value in intervals:
+        k = bisect.bisect_right(segment_starts, second) - 1
+        for j in range(second - segment_starts[k], next_second - segment_starts[k]):
+            segments[k][j] = value
+    return segments
+
+
+def get_best_averages(values, durations):
+    """
+    Returns the maximal average of values over windows of each of the durations, computed from prefix sums in O(n)
+    per duration. Windows containing None are skipped; durations without any window are omitted.
+    """
+    sums = [0.0]
+    counts = [0]
+    for value in values:
+        sums.append(sums[-1] + (value if value is not None else 0.0))
+        counts.append(counts[-1] + (value is not None))
+    best_averages = {}
+    for duration in durations:
+        best_sum = None
+        for i in range(duration, len(sums)):
+            if counts[i] - counts[i - duration] == duration and (
+                    best_sum is None or sums[i] - sums[i - duration] > best_sum):
+                best_sum = sums[i] - sums[i - duration]
+        if best_sum is not None:
+            best_averages[duration] = best_sum / duration
+    return best_averages
+
+
+def iter_gpx_xml(gpx):
+    """
+    Yields the same document as gpx.to_xml() in small chunks (one per track point), so the whole track is
+    never held as a single string.
+    """
+    version = gpx.version if gpx.version else '1.1'
+    head, tail = _split_xml_at_children(gpx, 'tracks', gpxpy.gpx.GPXTrack(name=_placeholder_name()), None, 'trk',
+                                        version, gpx.nsmap, '')
+    yield head
+    for track in gpx.tracks:
+        track_head, track_tail = _split_xml_at_children(track, 'segments', gpxpy.gpx.GPXTrackSegment(), 'trk',
+                                                        'trkseg', version, gpx.nsmap, '  ')
+        yield track_head
+        for segment in track.segments:
+            segment_head, segment_tail = _split_xml_at_children(
+                segment, 'points', gpxpy.gpx.GPXTrackPoint(0, 0, name=_placeholder_name()), 'trkseg', 'trkpt',
+                version, gpx.nsmap, '    ')
+            yield segment_head
+            for point in segment.points:
+                yield mod_gpxfield.gpx_fields_to_xml(point, 'trkpt', version, nsmap=gpx.nsmap, indent='      ')
+            yield segment_tail
+        yield track_tail
+    yield tail
+
+
+def _split_xml_at_children(instance, field_name, placeholder, tag, child_tag, version, nsmap, indent):
+    """
+    Serializes instance with placeholder as its only child and returns the xml before and after the child. The
+    gpx root (tag None) is serialized with to_xml() to keep the xml declaration and namespaces.
+    """
+    children = getattr(instance, field_name)
+    setattr(instance, field_name, [placeholder])
+    try:
+        if tag:
+            content = mod_gpxfield.gpx_fields_to_xml(instance, tag, version, nsmap=nsmap, indent=indent)
+        else:
+            content = instance.to_xml(version)
+    finally:
+        setattr(instance, field_name, children)
+    placeholder_xml = mod_gpxfield.gpx_fields_to_xml(placeholder, child_tag, version, nsmap=nsmap,
+                                                     indent=indent + '  ')
+    head, tail = content.split(placeholder_xml)
+    return head, tail
+
+
+def _placeholder_name():
+    return uuid.uuid4().hex
+
+
+def write_atomically(file, chunks, compress=False):
+    """
+    Writes the given string chunks to a temporary file next to file, syncs it to disk and renames it to file
+    afterwards. The file keeps the mode of an existing file, otherwise it is created with the default mode of the current umask.
+    """
+    directory, name = os.path.split(os.path.abspath(file))
+    tmp_file = os.path.join(directory, f".{name}.{uuid.uuid4().hex}.tmp")
+    fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        with os.fdopen(fd, "wb") as raw:
+            if compress:
+                with gzip.GzipFile(filename=name, mode="wb", fileobj=raw) as zipped:
+                    for chunk in chunks:
+                        zipped.write(chunk.encode("utf-8"))
+            else:
+                for chunk in chunks:
+                    raw.write(chunk.encode("utf-8"))
+            raw.flush()
+            os.fsync(raw.fileno())
+        if os.path.exists(file):
+            shutil.copymode(file, tmp_file)
+        os.replace(tmp_file, file)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+
 def prefix_filename(fn: str) -> str:
     return fn.replace(".gpx", TrackAnalyzer.SUFFIX + ".gpx")
@@ -0,0 +1,85 @@
+import os
+import struct
+import tempfile
+
+from src.elevation_model import ElevationModel, get_tile_name
+from src.gpx_track_analyzer import TrackAnalyzer, interpolate_missing_values
+
+
+def write_tile(directory, latitude, longitude, size, get_value):
+    with open(os.path.join(directory, get_tile_name(latitude, longitude)), "wb") as f:
+        for row in range(size):
+            for column in range(size):
+                f.write(struct.pack(">h", get_value(row, column)))
+
+
+def test_get_tile_name():
+    assert get_tile_name(47, 11) == "N47E011.hgt"
+    assert get_tile_name(-1, -71) == "S01W071.hgt"
+
+
+def test_get_elevations():
+    directory = tempfile.TemporaryDirectory()
+    write_tile(directory.name, 47, 11, 11, lambda row, column: 1000 + 10 * row + column)
+    write_tile(directory.name, 48, 11, 11, lambda row, column: ElevationModel.VOID if row == 0 else 500)
+
+    with ElevationModel(directory.name, max_open_tiles=1) as elevation_model:
+        elevations = elevation_model.get_elevations([47.5, 47.05, 47.55, 47.05, 48.5, 48.95, 46.5],
+                                                    [11.0, 11.95, 11.25, 11.5, 11.5, 11.5, 11.5])
+        assert elevations[0] == 1050
+        assert abs(elevations[1] - 1104.5) < 1e-9
+        assert abs(elevations[2] - 1047.5) < 1e-9
+        assert abs(elevations[3] - 1100) < 1e-9
+        assert elevations[4] == 500
+        assert elevations[5] is None
+        assert elevations[6] is None
+        assert len(elevation_model.tiles) == 1
+
+
+def test_analyzing_track_with_elevation_model():
+    file = "resources/track4.gpx"
+    directory = tempfile.TemporaryDirectory()
+    write_tile(directory.name, 47, 11, 101, lambda row, column: 2000 - 10 * row)
+
+    analyzer = TrackAnalyzer(file)
+    analyzer.analyze()
+    analyzer.get_maximal_values()
+    with ElevationModel(directory.name) as elevation_model:
+        corrected_analyzer = TrackAnalyzer(file, elevation_model=elevation_model)
+        corrected_analyzer.analyze()
+        corrected_analyzer.get_maximal_values()
+    point = corrected_analyzer.all_points[0]
+    assert abs(corrected_analyzer.corrected_elevations[0] - (2000 - 10 * (48 - point.latitude) * 100)) < 1e-6
+    assert point.elevation == analyzer.all_points[0].elevation
+    assert analyzer.vertical_velocities_60s > 0
+    assert corrected_analyzer.vertical_velocities_60s == 0
+    assert abs(corrected_analyzer.slope_100 - analyzer.slope_100) > 1
+
+
+def test_analyzing_track_with_partly_void_elevation_model():
+    file = "resources/track4.gpx"
+    directory = tempfile.TemporaryDirectory()
+    write_tile(directory.name, 47, 11, 1201, lambda row, column: ElevationModel.VOID if (row, column) == (980, 764)
+               else 3000 - row)
+
+    with ElevationModel(directory.name) as elevation_model:
+        analyzer = TrackAnalyzer(file, elevation_model=elevation_model)
+        analyzer.set_all_points_with_distance()
+    elevations = analyzer.corrected_elevations
+    assert None not in elevations
+    for i in range(277, 312):
+        assert abs(elevations[i] - (elevations[276] + (elevations[312] - elevations[276]) * (i - 276) / 36)) < 1e-6
+    assert abs(elevations[0] - (3000 - (48 - analyzer.all_points[0].latitude) * 1200)) < 1e-6
+
+    write_tile(directory.name, 47, 11, 1201, lambda row, column: ElevationModel.VOID if row > 990 else 3000 - row)
+    with ElevationModel(directory.name) as elevation_model:
+        analyzer = TrackAnalyzer(file, elevation_model=elevation_model)
+        analyzer.set_all_points_with_distance()
+    assert analyzer.corrected_elevations == [point.elevation for point in analyzer.all_points]
+
+
+def test_interpolate_missing_values():
+    assert interpolate_missing_values([1, None, None, 4, 5], 2) == [1, 2, 3, 4, 5]
+    assert interpolate_missing_values([1, None, None, 4], 1) is None
+    assert interpolate_missing_values([None, 1], 2) is None
+    assert interpolate_missing_values([1, None], 2) is None
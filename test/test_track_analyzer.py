@@ -1,10 +1,13 @@
+import datetime
+import gzip
+import os
 import tempfile
 
 import gpxpy
 
 from src.gpx_track_analyzer import TrackAnalyzer, reduce_track_to_relevant_elevation_points, \
     remove_elevation_differences_smaller_as, \
-    prefix_filename
+    prefix_filename, resample_to_seconds, get_best_averages, get_running_maxima, get_window_end
 
 
 def test_analyzing_track_with_errors():
@@ -63,6 +66,64 @@ def test_analyzing_track_gpx():
     assert open(gpx_file_gpxpy, "r").read() == gpx_file_gpxpy_content
 
 
+def test_write_compressed_files_without_changing_track():
+    file = "resources/track4.gpx"
+
+    analyzer = TrackAnalyzer(file, True, compress_output=True)
+    analyzer.analyze()
+    analyzer.get_maximal_values()
+    xml = analyzer.gpx.to_xml()
+
+    output_dir = tempfile.TemporaryDirectory()
+    output_file = os.path.join(output_dir.name, "track.gpx")
+    analyzer.write_file(output_file)
+    assert analyzer.gpx.to_xml() == xml
+    assert sorted(os.listdir(output_dir.name)) == ["track.gpx.gz", "track_gpxpy.json.gz",
+                                                   "track_simplified.gpx.gz"]
+
+    gpx = gpxpy.parse(gzip.open(output_file + ".gz", "rt").read())
+    assert len(get_points(gpx)) == len(analyzer.all_points)
+    gpx = gpxpy.parse(gzip.open(os.path.join(output_dir.name, "track_simplified.gpx.gz"), "rt").read())
+    assert 0 < len(get_points(gpx)) < len(analyzer.all_points)
+    assert gzip.open(os.path.join(output_dir.name, "track_gpxpy.json.gz"), "rt").read().startswith("{")
+
+
+def test_write_file_keeps_mode_of_existing_file():
+    file = "resources/track4.gpx"
+
+    analyzer = TrackAnalyzer(file, True)
+    analyzer.analyze()
+    analyzer.get_maximal_values()
+
+    output_dir = tempfile.TemporaryDirectory()
+    output_file = os.path.join(output_dir.name, "track.gpx")
+    old_umask = os.umask(0o077)
+    try:
+        analyzer.write_file(output_file)
+    finally:
+        os.umask(old_umask)
+    assert os.stat(output_file).st_mode & 0o777 == 0o600
+    os.chmod(output_file, 0o640)
+    analyzer.write_file(output_file)
+    assert os.stat(output_file).st_mode & 0o777 == 0o640
+    assert not [name for name in os.listdir(output_dir.name) if name.endswith(".tmp")]
+
+
+def test_analyzing_track_in_chunks():
+    file = "resources/track.gpx"
+
+    analyzer = TrackAnalyzer(file)
+    analyzer.analyze()
+    for processes in [2, 3]:
+        chunked_analyzer = TrackAnalyzer(file, processes=processes)
+        chunked_analyzer.analyze()
+        assert [point.distance for point in chunked_analyzer.all_points] == [point.distance for point in
+                                                                            analyzer.all_points]
+        assert chunked_analyzer.slopes == analyzer.slopes
+        assert chunked_analyzer.vertical_velocities == analyzer.vertical_velocities
+        assert chunked_analyzer.gpx.to_xml() == analyzer.gpx.to_xml()
+
+
 def test_analyzing_track2_gpx():
     file = "resources/track2.gpx"
 
@@ -115,6 +176,130 @@ def test_analyzing_track3_gpx():
     assert analyzer.duration < 30
 
 
+def test_best_efforts_track2_gpx():
+    file = "resources/track2.gpx"
+
+    analyzer = TrackAnalyzer(file)
+    analyzer.set_all_points_with_distance()
+    analyzer.set_extension_values()
+    analyzer.set_best_efforts()
+    assert sorted(analyzer.extension_values.keys()) == ["heart_rate", "temperature"]
+    assert list(analyzer.best_efforts.keys()) == ["heart_rate"]
+    assert analyzer.best_efforts["heart_rate"][1] == 174.0
+    assert abs(analyzer.best_efforts["heart_rate"][60] - 170.4) < 0.01
+    assert abs(analyzer.best_efforts["heart_rate"][1800] - 162.04) < 0.01
+    assert 3600 not in analyzer.best_efforts["heart_rate"]
+
+    analyzer.set_gpx_data()
+    assert analyzer.data["max_avg_heart_rate_60s"] == 170.4
+
+
+def test_best_efforts_of_cadence_and_power():
+    points = []
+    for i in range(120):
+        cadence = "n/a" if i == 10 else "90"
+        power = f"<power>{i}</power>" if i < 60 else f"<ns3:TrackPointExtension><ns3:PowerInWatts>{i}" \
+                                                     f"</ns3:PowerInWatts></ns3:TrackPointExtension>"
+        points.append(f'<trkpt lat="47.0" lon="{11 + i / 10000}"><ele>1000</ele>'
+                      f'<time>2021-06-13T10:{i // 60:02d}:{i % 60:02d}Z</time>'
+                      f'<extensions><cad>{cadence}</cad>{power}</extensions></trkpt>')
+    output_file = tempfile.NamedTemporaryFile(suffix=".gpx", mode="w")
+    output_file.write('<?xml version="1.0" encoding="UTF-8"?><gpx version="1.1" creator="test" '
+                      'xmlns="http://www.topografix.com/GPX/1/1" '
+                      'xmlns:ns3="http://www.garmin.com/xmlschemas/TrackPointExtension/v1">'
+                      f'<trk><trkseg>{"".join(points)}</trkseg></trk></gpx>')
+    output_file.flush()
+
+    analyzer = TrackAnalyzer(output_file.name)
+    analyzer.set_all_points_with_distance()
+    analyzer.set_extension_values()
+    analyzer.set_best_efforts()
+    assert sorted(analyzer.extension_values.keys()) == ["cadence", "power"]
+    assert analyzer.extension_values["cadence"][10] is None
+    assert analyzer.best_efforts["cadence"][60] == 90
+    assert 120 not in analyzer.best_efforts["cadence"]
+    assert analyzer.best_efforts["power"][1] == 119
+    assert analyzer.best_efforts["power"][60] == 89.5
+
+    analyzer.set_gpx_data()
+    assert analyzer.data["max_avg_power_120s"] == 59.5
+    assert analyzer.data["max_avg_cadence_5s"] == 90
+
+
+def test_resample_to_seconds():
+    assert resample_to_seconds([0, 2, 3, 10], [1, 2, None, 4], 5) == [[1, 1, 2], [4]]
+    assert resample_to_seconds([0, 2, 3, 10], [1, 2, 3, 4], 5, True) == [[1, 1, 2, 3, 3, 3, 3, 3, 3, 3, 4]]
+    assert resample_to_seconds([0, 2, 3, -2], [1, 2, 3, 4], 5) == [[4], [1, 1, 2, 3]]
+    assert resample_to_seconds([-86400 * 60, 0, 1], [1, 2, 3], 5) == [[1], [2, 3]]
+    assert resample_to_seconds([-86400 * 60, 0, 1], [1, 2, 3], 5, True, 3) == [[1, 1, 1], [2, 3]]
+
+
+def test_analyzing_track_with_time_going_backwards():
+    gpx = gpxpy.parse(open("resources/track2.gpx", "r"))
+    points = gpx.tracks[0].segments[0].points
+    points[-1].time = points[0].time - datetime.timedelta(seconds=5)
+    output_file = tempfile.NamedTemporaryFile(suffix=".gpx", mode="w")
+    output_file.write(gpx.to_xml())
+    output_file.flush()
+
+    analyzer = TrackAnalyzer(output_file.name)
+    analyzer.analyze()
+    analyzer.get_maximal_values()
+    assert analyzer.best_efforts["heart_rate"][1] == 174.0
+    assert abs(analyzer.vertical_velocities_60s - 0.2871) < 0.0001
+    assert abs(analyzer.vertical_velocities_3600s - 0.1850) < 0.0001
+
+
+def test_get_window_end():
+    times = [0.0, 1.0, 2.0, 4.0, 5.5, 7.0, 8.0, 9.0, 10.0, 11.0, 12.0, 13.0, 20.0, 30.0, 40.0]
+    max_times = get_running_maxima(times)
+    assert max_times == times
+    assert get_window_end(times, max_times, 0, 5) == 10
+    assert get_window_end(times, max_times, 0, 15) == 12
+    assert get_window_end(times, max_times, 1, 100) == 13
+    assert get_window_end(times, max_times, 4, 5) is None
+    assert get_running_maxima([0.0, 1.5, 0.5, 2.5]) == [0.0, 1.5, 1.5, 2.5]
+    times = [0.0, 5.0] + [1.0] * 10 + [3.0, 6.0]
+    assert get_window_end(times, get_running_maxima(times), 0, 2) == 12
+
+
+def test_analyzing_track_with_outlier_time():
+    gpx = gpxpy.parse(open("resources/track2.gpx", "r"))
+    points = gpx.tracks[0].segments[0].points
+    points[0].time -= datetime.timedelta(days=60)
+    output_file = tempfile.NamedTemporaryFile(suffix=".gpx", mode="w")
+    output_file.write(gpx.to_xml())
+    output_file.flush()
+
+    for pause_handling in TrackAnalyzer.PAUSE_HANDLINGS:
+        analyzer = TrackAnalyzer(output_file.name, pause_handling=pause_handling)
+        analyzer.analyze()
+        analyzer.get_maximal_values()
+        assert len(analyzer.max_times) == len(analyzer.points_with_time)
+        assert analyzer.best_efforts["heart_rate"][1] == 174.0
+        assert 0 < analyzer.vertical_velocities_3600s < 0.2
+
+
+def test_pause_handling():
+    file = "resources/track2.gpx"
+
+    analyzer = TrackAnalyzer(file, pause_handling="remove")
+    analyzer.set_all_points_with_distance()
+    assert analyzer.times[-1] < (analyzer.points_with_time[-1].time - analyzer.points_with_time[0].time).seconds
+    assert max(b - a for a, b in zip(analyzer.times, analyzer.times[1:])) <= TrackAnalyzer.MAX_RESAMPLING_GAP
+
+    analyzer = TrackAnalyzer(file, pause_handling="hold")
+    analyzer.set_all_points_with_distance()
+    analyzer.set_extension_values()
+    analyzer.set_best_efforts()
+    assert 3600 in analyzer.best_efforts["heart_rate"]
+
+
+def test_get_best_averages():
+    values = [1, 3, 2, None, 5, 5]
+    assert get_best_averages(values, [1, 2, 3, 4]) == {1: 5, 2: 5, 3: 2}
+
+
 def test_analyzing_track4_gpx():
     file = "resources/track4.gpx"
 